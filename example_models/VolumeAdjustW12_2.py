@@ -1,11 +1,13 @@
+from array import array
 from datetime import datetime
 from bisect import bisect
 import itertools
 import asyncio
 import math
+import struct
 import time
 
-from typing import List, Tuple
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 
 from ready_trader_go import (
     BaseAutoTrader,
@@ -15,6 +17,14 @@ from ready_trader_go import (
     MINIMUM_BID,
     Side,
 )
+from ready_trader_go.messages import (
+    CANCEL_MESSAGE,
+    CANCEL_MESSAGE_SIZE,
+    HEADER,
+    INSERT_MESSAGE,
+    INSERT_MESSAGE_SIZE,
+    MessageType,
+)
 
 
 LOT_SIZE = 10
@@ -24,6 +34,82 @@ MIN_BID_NEAREST_TICK = (
     (MINIMUM_BID + TICK_SIZE_IN_CENTS) // TICK_SIZE_IN_CENTS * TICK_SIZE_IN_CENTS
 )
 MAX_ASK_NEAREST_TICK = MAXIMUM_ASK // TICK_SIZE_IN_CENTS * TICK_SIZE_IN_CENTS
+ORDER_ID_POOL_SIZE = 64
+
+# Clock for the message budget window; unaffected by wall-clock adjustments.
+_now = time.monotonic
+
+# Header and body of a message packed in one go.
+CANCEL_FRAME = struct.Struct(HEADER.format + CANCEL_MESSAGE.format[1:])
+INSERT_FRAME = struct.Struct(HEADER.format + INSERT_MESSAGE.format[1:])
+
+
+def compute_quotes(
+    ask_prices: Sequence[int],
+    ask_volumes: Sequence[int],
+    bid_prices: Sequence[int],
+    bid_volumes: Sequence[int],
+    position: int,
+    new_bid_price: int,
+    new_ask_price: int,
+    l0_w: int,
+    l1_w: int,
+    ladder_bid: "array[int]",
+    ladder_ask: "array[int]",
+) -> Tuple[int, int, int, int]:
+    """Return the bid and ask prices and volumes to quote for a book update.
+
+    Prices are kept from the previous update if the bid side of the book is
+    incomplete. Volumes are the ladder volumes for the position, reduced by
+    the position itself.
+    """
+
+    # Theoretical price = weighted average orderbook levels 1 and 2.
+    if 0 not in bid_prices:
+
+        # Weighted volumes, each shared by the numerator and denominator.
+        bid_w0 = bid_volumes[0] * l0_w
+        bid_w1 = bid_volumes[1] * l1_w
+        ask_w0 = ask_volumes[0] * l0_w
+        ask_w1 = ask_volumes[1] * l1_w
+
+        numerator = (
+            bid_prices[0] * bid_w0
+            + bid_prices[1] * bid_w1
+            + ask_prices[0] * ask_w0
+            + ask_prices[1] * ask_w1
+        )
+        denominator = bid_w0 + bid_w1 + ask_w0 + ask_w1
+
+        # Snap the weighted mean down to the tick grid.
+        theo_price = numerator // denominator // 100 * 100
+
+        # Use theo price += $1 for bid/ask.
+        new_bid_price = theo_price - 100 if bid_prices[0] != 0 else 0
+        new_ask_price = theo_price + 100 if ask_prices[0] != 0 else 0
+
+    # Fills can carry the position past the limit just before a breach, where
+    # the ladder ends hold the same volumes bisect would have picked.
+    index = position + POSITION_LIMIT
+    if index < 0:
+        index = 0
+    elif index > 2 * POSITION_LIMIT:
+        index = 2 * POSITION_LIMIT
+    bid_volume = ladder_bid[index]
+    ask_volume = ladder_ask[index]
+
+    if position >= 0:
+        bid_volume -= position
+    else:
+        # Position is negative here, so this takes off its magnitude.
+        ask_volume += position
+
+    # Correct negative quote volumes to prevent exchange error. A conditional
+    # expression is cheaper here than max() or a sign mask.
+    bid_volume = 0 if bid_volume < 0 else bid_volume
+    ask_volume = 0 if ask_volume < 0 else ask_volume
+
+    return new_bid_price, new_ask_price, bid_volume, ask_volume
 
 
 class AutoTrader(BaseAutoTrader):
@@ -31,30 +117,57 @@ class AutoTrader(BaseAutoTrader):
         """Initialise a new instance of the AutoTrader class."""
 
         super().__init__(loop, team_name, secret)
-        self.order_ids = itertools.count(1)
-        self.ask_id = (
-            self.ask_price
-        ) = self.bid_id = self.bid_price = self.position = self.size = 0
+        self.order_ids: Iterator[int] = itertools.count(1)
 
-        self.bid_volume = self.ask_volume = self.new_bid_price = self.new_ask_price = 0
-
-        self.last_bid_id = self.last_ask_id = 0
-
-        self.abs_position = 0
-        self.theo_price = 0
-
-        self.bids = set()
-        self.asks = set()
+        # Order ids are taken from order_ids in blocks, so they stay increasing.
+        self._id_pool: List[int] = list(
+            itertools.islice(self.order_ids, ORDER_ID_POOL_SIZE)
+        )
+        self._id_index: int = 0
+
+        self.ask_id: int = 0
+        self.ask_price: int = 0
+        self.bid_id: int = 0
+        self.bid_price: int = 0
+        self.position: int = 0
+        self.size: int = 0
+
+        self.bid_volume: int = 0
+        self.ask_volume: int = 0
+        self.new_bid_price: int = 0
+        self.new_ask_price: int = 0
+
+        # Side of every live quote, +1 for a bid and -1 for an ask. Cancelled
+        # quotes stay until the exchange confirms, as they can still fill.
+        self._side_of: Dict[int, int] = {}
+
+        self.abs_position: int = 0
+
+        self.start_second: float = 0.0
+        self.current_time: float = 0.0
+        self.time_diff: float = 0.0
+        self.action_count: int = 0
+
+        # Set while the current second still has actions left to spend.
+        self._budget_event: asyncio.Event = asyncio.Event()
+        self._budget_event.set()
+        self._cached_book: Optional[
+            Tuple[int, Sequence[int], Sequence[int], Sequence[int], Sequence[int]]
+        ] = None
+        self._requote_task: Optional[asyncio.Task] = None
+
+        # Messages for the exchange, sent together at the end of a book update.
+        self._send_buffer: bytearray = bytearray(
+            2 * CANCEL_MESSAGE_SIZE + 2 * INSERT_MESSAGE_SIZE
+        )
+        self._send_length: int = 0
 
-        self.start_second = 0
-        self.current_time = 0
-        self.time_diff = 0
-        self.action_count = 0
+        self._last_top_levels: Optional[Tuple[int, ...]] = None
+        self._last_position: int = 0
 
-        self.risk_factor = 4
-        self.position_interval = 0
+        self.risk_factor: int = 4
         self.position_step = (-94, -90, -81, -64, -44, 0, 1, 45, 65, 82, 91, 95)
-        self.quote_ladder = (
+        self.quote_ladder: Tuple[Tuple[int, int], ...] = (
             (95, 97),
             (95, 95),
             (85, 90),
@@ -70,19 +183,44 @@ class AutoTrader(BaseAutoTrader):
             (97 - self.risk_factor, 95),
         )
 
-        self.l0_w = 0.35
-        self.l1_w = 0.65
+        # Ladder volumes for every position, indexed by position + POSITION_LIMIT.
+        intervals = [
+            bisect(self.position_step, position)
+            for position in range(-POSITION_LIMIT, POSITION_LIMIT + 1)
+        ]
+        self._ladder_bid: "array[int]" = array(
+            "q", [self.quote_ladder[i][0] for i in intervals]
+        )
+        self._ladder_ask: "array[int]" = array(
+            "q", [self.quote_ladder[i][1] for i in intervals]
+        )
+
+        # Level weights in per cent, so that the theoretical price stays in ints.
+        self.l0_w: int = 35
+        self.l1_w: int = 65
+
+    def _next_order_id(self) -> int:
+        """Return the next client order id from the preallocated pool."""
+
+        index = self._id_index
+        order_id = self._id_pool[index]
+        index += 1
+        if index == ORDER_ID_POOL_SIZE:
+            self._refill_id_pool()
+        else:
+            self._id_index = index
+        return order_id
+
+    def _refill_id_pool(self) -> None:
+        """Take the next block of client order ids from order_ids."""
 
-        self._abs = abs
-        self._int = int
-        self._bisect = bisect
-        self._print = print
-        self._next = next
+        self._id_pool[:] = itertools.islice(self.order_ids, ORDER_ID_POOL_SIZE)
+        self._id_index = 0
 
     def on_error_message(self, client_order_id: int, error_message: bytes) -> None:
         """Called when the exchange detects an error."""
 
-        self._print(
+        print(
             "error with order",
             client_order_id,
             error_message.decode(),
@@ -102,129 +240,223 @@ class AutoTrader(BaseAutoTrader):
         self,
         instrument: int,
         sequence_number: int,
-        ask_prices: List[int],
-        ask_volumes: List[int],
-        bid_prices: List[int],
-        bid_volumes: List[int],
+        ask_prices: Sequence[int],
+        ask_volumes: Sequence[int],
+        bid_prices: Sequence[int],
+        bid_volumes: Sequence[int],
+        _future: Instrument = Instrument.FUTURE,
+        _buy: Side = Side.BUY,
+        _sell: Side = Side.SELL,
+        _good_for_day: Lifespan = Lifespan.GOOD_FOR_DAY,
     ) -> None:
         """Called periodically to report the status of an order book."""
 
-        if instrument == Instrument.FUTURE:
-
-            # Count action
-            if self.action_count == 0:
-                self.start_second = time.time()
-
-            # Theoretical price = weighted average orderbook levels 1, 2 and 3.
-            if 0 not in bid_prices and self.action_count <= 16:
-                self.theo_price = (
-                    self._int(
-                        (
-                            (
-                                (
-                                    ((bid_prices[0] * bid_volumes[0]) * self.l0_w)
-                                    + ((bid_prices[1] * bid_volumes[1]) * self.l1_w)
-                                    + ((ask_prices[0] * ask_volumes[0]) * self.l0_w)
-                                    + ((ask_prices[1] * ask_volumes[1]) * self.l1_w)
-                                )
-                                / (
-                                    (bid_volumes[0] * self.l0_w)
-                                    + (bid_volumes[1] * self.l1_w)
-                                    + (
-                                        ask_volumes[0] * self.l0_w
-                                        + (ask_volumes[1] * self.l1_w)
-                                    )
-                                )
-                            )
-                        )
-                        / 100
-                    )
-                    * 100
+        # The underscored defaults bind enum members as locals.
+        if instrument == _future:
+
+            # Hold on to the latest book until the action budget is reset.
+            if not self._budget_event.is_set():
+                self._cached_book = (
+                    sequence_number,
+                    ask_prices,
+                    ask_volumes,
+                    bid_prices,
+                    bid_volumes,
                 )
+                return
+
+            self._cached_book = None
+            position = self.position
+
+            # Quotes only depend on the top two levels, the position, and
+            # whether the bid side is complete enough to reprice.
+            top_levels = (
+                bid_prices[0],
+                bid_volumes[0],
+                bid_prices[1],
+                bid_volumes[1],
+                ask_prices[0],
+                ask_volumes[0],
+                ask_prices[1],
+                ask_volumes[1],
+                0 in bid_prices,
+            )
+            if top_levels == self._last_top_levels and position == self._last_position:
+                return
 
-                # Use theo price += $1 for bid/ask.
-                self.new_bid_price = self.theo_price - 100 if bid_prices[0] != 0 else 0
-                self.new_ask_price = self.theo_price + 100 if ask_prices[0] != 0 else 0
-
-            # Place new orders if within action limit.
-            if self.action_count <= 16:
-
-                # Cancel existing quotes if they differ from new quotes.
-                if self.bid_id != 0 and self.new_bid_price not in (self.bid_price, 0):
-                    self.send_cancel_order(self.bid_id)
-                    self.bid_id = 0
-                    self.action_count += 1
-                if self.ask_id != 0 and self.new_ask_price not in (self.ask_price, 0):
-                    self.send_cancel_order(self.ask_id)
-                    self.ask_id = 0
-                    self.action_count += 1
-
-            # Place new orders if within action limit.
-            if self.action_count <= 14:
-
-                self.position_interval = self._bisect(self.position_step, self.position)
+            ask_id = self.ask_id
+            ask_price = self.ask_price
+            bid_id = self.bid_id
+            bid_price = self.bid_price
+            action_count = self.action_count
 
-                self.bid_volume, self.ask_volume = self.quote_ladder[
-                    self.position_interval
-                ]
+            # Count action
+            if action_count == 0:
+                self.start_second = _now()
+
+            new_bid_price, new_ask_price, bid_volume, ask_volume = compute_quotes(
+                ask_prices,
+                ask_volumes,
+                bid_prices,
+                bid_volumes,
+                position,
+                self.new_bid_price,
+                self.new_ask_price,
+                self.l0_w,
+                self.l1_w,
+                self._ladder_bid,
+                self._ladder_ask,
+            )
 
-                if self.position >= 0:
-                    self.bid_volume -= self.position
-                else:
-                    self.ask_volume -= self._abs(self.position)
+            # Cancel existing quotes if they differ from new quotes. Updates
+            # are only handled with at most 16 actions spent this second.
+            if bid_id != 0 and new_bid_price != bid_price and new_bid_price != 0:
+                self._queue_cancel_order(bid_id)
+                bid_id = 0
+                action_count += 1
+            if ask_id != 0 and new_ask_price != ask_price and new_ask_price != 0:
+                self._queue_cancel_order(ask_id)
+                ask_id = 0
+                action_count += 1
 
-                # Correct negative quote volumes to prevent exchange error.
-                self.bid_volume = 0 if self.bid_volume < 0 else self.bid_volume
-                self.ask_volume = 0 if self.ask_volume < 0 else self.ask_volume
+            # Place new orders if within action limit.
+            if action_count <= 14:
+                side_of = self._side_of
 
                 # Place bid quote.
-                if (
-                    self.bid_id == 0
-                    and self.new_bid_price != 0
-                    and self.bid_volume != 0
-                ):
-                    self.bid_id = self._next(self.order_ids)
-                    self.bid_price = self.new_bid_price
-                    self.send_insert_order(
-                        self.bid_id,
-                        Side.BUY,
-                        self.new_bid_price,
-                        self.bid_volume,
-                        Lifespan.GOOD_FOR_DAY,
+                if bid_id == 0 and new_bid_price != 0 and bid_volume != 0:
+                    bid_id = self._next_order_id()
+                    bid_price = new_bid_price
+                    side_of[bid_id] = 1
+                    self._queue_insert_order(
+                        bid_id,
+                        _buy,
+                        new_bid_price,
+                        bid_volume,
+                        _good_for_day,
                     )
-                    self.bids.add(self.bid_id)
-                    self.action_count += 1
+                    action_count += 1
 
                 # Place ask quote.
-                if (
-                    self.ask_id == 0
-                    and self.new_ask_price != 0
-                    and self.ask_volume != 0
-                ):
-                    self.ask_id = self._next(self.order_ids)
-                    self.ask_price = self.new_ask_price
-                    self.send_insert_order(
-                        self.ask_id,
-                        Side.SELL,
-                        self.new_ask_price,
-                        self.ask_volume,
-                        Lifespan.GOOD_FOR_DAY,
+                if ask_id == 0 and new_ask_price != 0 and ask_volume != 0:
+                    ask_id = self._next_order_id()
+                    ask_price = new_ask_price
+                    side_of[ask_id] = -1
+                    self._queue_insert_order(
+                        ask_id,
+                        _sell,
+                        new_ask_price,
+                        ask_volume,
+                        _good_for_day,
                     )
-                    self.asks.add(self.ask_id)
-                    self.action_count += 1
+                    action_count += 1
+
+                # Quotes are up to date until the book or position moves. Past
+                # the budget the next update must still reset or pause it.
+                if action_count <= 14:
+                    self._last_top_levels = top_levels
+                    self._last_position = position
+                else:
+                    self._last_top_levels = None
 
             # Reset action count if within time constraints.
-            elif self.action_count >= 14:
-                self.current_time = time.time()
+            else:
+                self._last_top_levels = None
+
+                self.current_time = _now()
                 self.time_diff = self.current_time - self.start_second
 
-                # print("Time diff:", self.time_diff, "Action count:", self.action_count)
+                # print("Time diff:", self.time_diff, "Action count:", action_count)
 
-                # Sleep for remainder of second if necessary.
+                # Pause quoting for remainder of second without blocking the loop.
                 if self.time_diff < 1:
-                    time.sleep(1.01 - self.time_diff)
+                    self._budget_event.clear()
+                    self.event_loop.call_later(
+                        1.01 - self.time_diff, self._reset_budget
+                    )
+                    self._requote_task = self.event_loop.create_task(
+                        self._requote_after_reset()
+                    )
+                else:
+                    action_count = 0
+
+            self.ask_id = ask_id
+            self.ask_price = ask_price
+            self.bid_id = bid_id
+            self.bid_price = bid_price
+            self.action_count = action_count
+            self.new_bid_price = new_bid_price
+            self.new_ask_price = new_ask_price
+            self.bid_volume = bid_volume
+            self.ask_volume = ask_volume
+
+            self._flush_send_buffer()
+
+    def _queue_cancel_order(self, client_order_id: int) -> None:
+        """Queue a cancel of the specified order for the next flush."""
+
+        offset = self._send_length
+        CANCEL_FRAME.pack_into(
+            self._send_buffer,
+            offset,
+            CANCEL_MESSAGE_SIZE,
+            MessageType.CANCEL_ORDER,
+            client_order_id,
+        )
+        self._send_length = offset + CANCEL_MESSAGE_SIZE
 
-                self.action_count = 0
+    def _queue_insert_order(
+        self,
+        client_order_id: int,
+        side: Side,
+        price: int,
+        volume: int,
+        lifespan: Lifespan,
+    ) -> None:
+        """Queue a new order for the next flush."""
+
+        offset = self._send_length
+        INSERT_FRAME.pack_into(
+            self._send_buffer,
+            offset,
+            INSERT_MESSAGE_SIZE,
+            MessageType.INSERT_ORDER,
+            client_order_id,
+            side,
+            price,
+            volume,
+            lifespan,
+        )
+        self._send_length = offset + INSERT_MESSAGE_SIZE
+
+    def _flush_send_buffer(self) -> None:
+        """Send the queued messages to the exchange in a single write."""
+
+        length = self._send_length
+        if length:
+            # Without a connection the messages are dropped rather than kept
+            # around to overflow the buffer or be sent once they are stale.
+            self._send_length = 0
+            transport = self._connection_transport
+            if transport is not None:
+                # Write a copy, as the transport may hold on to unsent data.
+                transport.write(self._send_buffer[:length])
+
+    def _reset_budget(self) -> None:
+        """Start a new one second action budget."""
+
+        self.action_count = 0
+        self._budget_event.set()
+
+    async def _requote_after_reset(self) -> None:
+        """Wait for the action budget to reset, then requote from the latest book."""
+
+        await self._budget_event.wait()
+
+        # A fresh book may have been handled before this task got to run.
+        if self._cached_book is not None:
+            cached_book, self._cached_book = self._cached_book, None
+            self.on_order_book_update_message(Instrument.FUTURE, *cached_book)
 
     def on_order_status_message(
         self, client_order_id: int, fill_volume: int, remaining_volume: int, fees: int
@@ -233,17 +465,23 @@ class AutoTrader(BaseAutoTrader):
 
         # Set order ID's for orders just filled.
         if remaining_volume == 0:
+            self._side_of.pop(client_order_id, None)
             if client_order_id == self.bid_id:
                 self.bid_id = 0
+                self._last_top_levels = None
             elif client_order_id == self.ask_id:
                 self.ask_id = 0
-
-            # It could be either a bid or an ask
-            self.bids.discard(client_order_id)
-            self.asks.discard(client_order_id)
+                self._last_top_levels = None
 
     def on_order_filled_message(
-        self, client_order_id: int, price: int, volume: int
+        self,
+        client_order_id: int,
+        price: int,
+        volume: int,
+        _min_bid: int = MIN_BID_NEAREST_TICK,
+        _max_ask: int = MAX_ASK_NEAREST_TICK,
+        _bid: Side = Side.BID,
+        _ask: Side = Side.ASK,
     ) -> None:
         """Called when one of your orders is filled, partially or fully.
 
@@ -257,16 +495,13 @@ class AutoTrader(BaseAutoTrader):
             price,
             volume,
         )
-        if client_order_id in self.bids:
+        side = self._side_of.get(client_order_id, 0)
+        if side > 0:
             self.position += volume
-            self.send_hedge_order(
-                next(self.order_ids), Side.ASK, MIN_BID_NEAREST_TICK, volume
-            )
-        elif client_order_id in self.asks:
+            self.send_hedge_order(self._next_order_id(), _ask, _min_bid, volume)
+        elif side < 0:
             self.position -= volume
-            self.send_hedge_order(
-                next(self.order_ids), Side.BID, MAX_ASK_NEAREST_TICK, volume
-            )
+            self.send_hedge_order(self._next_order_id(), _bid, _max_ask, volume)
 
     def on_trade_ticks_message(
         self,
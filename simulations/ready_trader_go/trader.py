@@ -29,6 +29,12 @@ from .base_auto_trader import BaseAutoTrader
 from .pubsub import SubscriberFactory
 
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+
 # From Python 3.8, the proactor event loop is used by default on Windows
 if sys.platform == "win32" and hasattr(asyncio, "WindowsSelectorEventLoopPolicy"):
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
@@ -101,6 +107,10 @@ async def __start_autotrader(
 
 def main(name: str = "autotrader") -> None:
     """Import the 'AutoTrader' class from the named module and run it."""
+    if uvloop is not None:
+        # uvloop dispatches callbacks with less overhead than the default loop
+        asyncio.set_event_loop(uvloop.new_event_loop())
+
     app = Application(name, __config_validator)
 
     sys.path.insert(0, os.getcwd())
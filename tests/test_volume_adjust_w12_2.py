@@ -0,0 +1,183 @@
+import asyncio
+import pathlib
+import sys
+import unittest
+from unittest import mock
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "simulations"))
+sys.path.insert(0, str(ROOT / "example_models"))
+
+from ready_trader_go import Instrument, Side
+from ready_trader_go.messages import (
+    CANCEL_MESSAGE,
+    HEADER,
+    HEDGE_MESSAGE,
+    INSERT_MESSAGE,
+    MessageType,
+)
+
+import VolumeAdjustW12_2
+from VolumeAdjustW12_2 import AutoTrader, compute_quotes
+
+BODIES = {
+    MessageType.CANCEL_ORDER: CANCEL_MESSAGE,
+    MessageType.HEDGE_ORDER: HEDGE_MESSAGE,
+    MessageType.INSERT_ORDER: INSERT_MESSAGE,
+}
+
+
+class RecordingTransport:
+    """Transport that records the messages written to it."""
+
+    def __init__(self):
+        self.messages = []
+
+    def write(self, data):
+        offset = 0
+        while offset < len(data):
+            length, typ = HEADER.unpack_from(data, offset)
+            body = BODIES[typ].unpack_from(data, offset + HEADER.size)
+            self.messages.append((MessageType(typ),) + body)
+            offset += length
+
+    def writelines(self, chunks):
+        self.write(b"".join(chunks))
+
+    def is_closing(self):
+        return False
+
+
+def book(mid, thin=False):
+    """Return an order book around mid, without a fifth bid level if thin."""
+
+    ask_prices = [mid + 100 * (i + 1) for i in range(5)]
+    bid_prices = [mid - 100 * (i + 1) for i in range(5)]
+    if thin:
+        bid_prices[4] = 0
+    return ask_prices, [10] * 5, bid_prices, [10] * 5
+
+
+class VolumeAdjustW12_2Test(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.trader = AutoTrader(self.loop, "", "")
+        self.transport = RecordingTransport()
+        self.trader._connection_transport = self.transport
+
+    def tearDown(self):
+        self.loop.close()
+
+    def update(self, sequence_number, levels):
+        self.transport.messages.clear()
+        self.trader.on_order_book_update_message(
+            Instrument.FUTURE, sequence_number, *levels
+        )
+        return list(self.transport.messages)
+
+    def quote(self, levels, position=0, bid_price=0, ask_price=0):
+        trader = self.trader
+        return compute_quotes(
+            *levels,
+            position,
+            bid_price,
+            ask_price,
+            trader.l0_w,
+            trader.l1_w,
+            trader._ladder_bid,
+            trader._ladder_ask,
+        )
+
+    def test_quotes_one_tick_either_side_of_theoretical_price(self):
+        bid_price, ask_price, bid_volume, ask_volume = self.quote(book(100000))
+        self.assertEqual((bid_price, ask_price), (99900, 100100))
+        self.assertEqual(bid_volume, self.trader._ladder_bid[100])
+        self.assertEqual(ask_volume, self.trader._ladder_ask[100])
+
+    def test_thin_bid_side_keeps_previous_prices(self):
+        quotes = self.quote(book(100000, thin=True), bid_price=99500, ask_price=99700)
+        self.assertEqual(quotes[:2], (99500, 99700))
+
+    def test_quote_volumes_never_negative(self):
+        for position in range(-100, 101):
+            _, _, bid_volume, ask_volume = self.quote(book(100000), position)
+            self.assertGreaterEqual(bid_volume, 0)
+            self.assertGreaterEqual(ask_volume, 0)
+
+    def test_positions_past_the_limit_use_the_ends_of_the_ladder(self):
+        ladder = self.trader.quote_ladder
+        _, _, bid_volume, ask_volume = self.quote(book(100000), 101)
+        self.assertEqual((bid_volume, ask_volume), (0, ladder[-1][1]))
+        _, _, bid_volume, ask_volume = self.quote(book(100000), -101)
+        self.assertEqual((bid_volume, ask_volume), (ladder[0][0], 0))
+
+    def test_requotes_when_bid_side_fills_in_below_unchanged_top(self):
+        self.assertTrue(self.update(1, book(100000)))
+
+        # An incomplete bid side keeps the previous quotes.
+        self.assertEqual(self.update(2, book(100500, thin=True)), [])
+
+        # The same top levels with a complete bid side reprice the quotes.
+        messages = self.update(3, book(100500))
+        types = [message[0] for message in messages]
+        self.assertIn(MessageType.CANCEL_ORDER, types)
+        self.assertIn(MessageType.INSERT_ORDER, types)
+
+    def test_unchanged_book_after_spending_budget_resets_it(self):
+        now = [0.0]
+        with mock.patch.object(VolumeAdjustW12_2, "_now", lambda: now[0]):
+            self.update(1, book(100000))
+
+            # Two cancels and two inserts take the count from 12 to 16.
+            self.trader.action_count = 12
+            self.update(2, book(100500))
+            self.assertEqual(self.trader.action_count, 16)
+
+            # Once the second is over, an unchanged book resets the budget.
+            now[0] = 1.5
+            self.update(3, book(100500))
+            self.assertEqual(self.trader.action_count, 0)
+
+            types = [message[0] for message in self.update(4, book(101000))]
+        self.assertEqual(types.count(MessageType.INSERT_ORDER), 2)
+
+    def test_hedges_fills_on_cancelled_quotes(self):
+        first = self.update(1, book(100000))
+        self.update(2, book(100500))
+        self.update(3, book(101000))
+        bid_id, ask_id = (message[1] for message in first)
+
+        # Neither cancel of the first quotes has been confirmed yet.
+        self.transport.messages.clear()
+        self.trader.on_order_filled_message(bid_id, 99900, 3)
+        self.trader.on_order_filled_message(ask_id, 100100, 1)
+        self.assertEqual(self.trader.position, 2)
+        self.assertEqual(
+            [(m[0], m[2], m[4]) for m in self.transport.messages],
+            [
+                (MessageType.HEDGE_ORDER, Side.ASK, 3),
+                (MessageType.HEDGE_ORDER, Side.BID, 1),
+            ],
+        )
+
+    def test_updates_without_a_connection_are_dropped(self):
+        self.trader._connection_transport = None
+        self.update(1, book(100000))
+        self.update(2, book(100500))
+
+        # Only the messages for the latest update reach the exchange.
+        self.trader._connection_transport = self.transport
+        messages = self.update(3, book(101000))
+        self.assertEqual(
+            [message[0] for message in messages],
+            [
+                MessageType.CANCEL_ORDER,
+                MessageType.CANCEL_ORDER,
+                MessageType.INSERT_ORDER,
+                MessageType.INSERT_ORDER,
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()